@@ -5,7 +5,8 @@ that orchestrates the full pipeline with *explicit* channel names and
 comment-based cycles only. No auto-detection is performed.
 
 Workflow:
-1) Load a LabChart .txt export via labchart_parser.LabChartFile
+1) Load a LabChart .txt export via labchart_parser.LabChartFile (or reuse
+   an already-loaded LabChartFile)
 2) Build cycles from INSPI/EXPI comments
 3) Always compute ventilatory metrics from flow/volume
 4) Optionally compute ventilator mechanics (PEEP, Pplat, etc.) if
@@ -14,23 +15,127 @@ Workflow:
 """
 
 from __future__ import annotations
-from typing import Optional, Dict
+from typing import Callable, Optional, Dict, Tuple, Union
+import hashlib
+import json
+import os
+import tempfile
 
+import numpy as np
+import pandas as pd
+from numpy.typing import DTypeLike
 from labchart_parser import LabChartFile
 from .cycles import cycles_from_comments
-from .ventilatory import ventilatory_from_cycles
+from .utils import block_arrays, flow_scale
+from .ventilatory import ventilatory_from_arrays
 
 try:
     # Optional mechanical ventilation metrics
-    from .mechanical_vent import mechanical_from_cycles
+    from .mechanical_vent import mechanical_from_arrays
     _HAS_VENTILATOR = True
 except Exception:  # pragma: no cover - absence is allowed
-    mechanical_from_cycles = None  # type: ignore
+    mechanical_from_arrays = None  # type: ignore
     _HAS_VENTILATOR = False
 
 
+def _json_default(obj: object) -> object:
+    """Make numpy scalars/arrays JSON-serialisable; anything else is stored as its string."""
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    return str(obj)
+
+
+def _atomic_write(dst: str, write: Callable[[str], None]) -> None:
+    """Call `write` on a temporary file next to `dst`, then move it into place.
+
+    Readers therefore see either a complete file or none, even if the write is
+    interrupted or several processes fill the same cache entry.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix=os.path.basename(dst) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+_MISSING = object()
+
+
+def _read_cached(f: str, read: Callable[[str], object]) -> object:
+    """Read a cache file, or return `_MISSING` if it is absent or cannot be read back."""
+    if not os.path.exists(f):
+        return _MISSING
+    try:
+        return read(f)
+    except (OSError, ValueError):  # damaged entry (ArrowInvalid and JSONDecodeError are ValueErrors)
+        return _MISSING
+
+
+def _read_json(f: str) -> object:
+    """Load a JSON cache file."""
+    with open(f, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _write_text(f: str, text: str) -> None:
+    """Write `text` to `f` as UTF-8."""
+    with open(f, "w", encoding="utf-8") as fh:
+        fh.write(text)
+
+
+def _load_block(
+    path: Union[str, LabChartFile],
+    block: int,
+    cache_dir: Optional[str],
+) -> Tuple[object, Optional[pd.DataFrame], pd.DataFrame]:
+    """Return (metadata, comments, block DataFrame), going through the Feather cache if enabled.
+
+    Cache entries are keyed by the file's absolute path, modification time and
+    size, so editing or re-exporting the .txt file invalidates them. Files
+    that are absent or cannot be read back are re-created from one parse; the
+    others are left untouched. Metadata always goes through JSON, so a hit and
+    a miss return the same objects.
+    """
+    if isinstance(path, LabChartFile):
+        return path.metadata, path.comments, path.get_block_df(block)
+    if cache_dir is None:
+        lc = LabChartFile.from_file(path)
+        return lc.metadata, lc.comments, lc.get_block_df(block)
+
+    src = os.path.abspath(path)
+    st = os.stat(src)
+    key = hashlib.sha1(f"{src}|{st.st_mtime_ns}|{st.st_size}".encode()).hexdigest()
+    f_meta = os.path.join(cache_dir, f"{key}_meta.json")
+    f_comments = os.path.join(cache_dir, f"{key}_comments.feather")
+    f_block = os.path.join(cache_dir, f"{key}_block{block}.feather")
+
+    meta = _read_cached(f_meta, _read_json)
+    comments = _read_cached(f_comments, pd.read_feather)
+    df_block = _read_cached(f_block, pd.read_feather)
+    if any(x is _MISSING for x in (meta, comments, df_block)):
+        # parse once, then write only the entries that are absent or damaged
+        lc = LabChartFile.from_file(path)
+        os.makedirs(cache_dir, exist_ok=True)
+        if meta is _MISSING:
+            # return the JSON round-trip, as a later cache hit would
+            text = json.dumps(lc.metadata, default=_json_default)
+            meta = json.loads(text)
+            _atomic_write(f_meta, lambda f: _write_text(f, text))
+        if comments is _MISSING:
+            comments = (lc.comments if lc.comments is not None else pd.DataFrame()).reset_index(drop=True)
+            _atomic_write(f_comments, lambda f: comments.to_feather(f, compression="lz4"))
+        if df_block is _MISSING:
+            df_block = lc.get_block_df(block).reset_index(drop=True)
+            _atomic_write(f_block, lambda f: df_block.to_feather(f, compression="lz4"))
+    return meta, comments, df_block
+
+
 def compute_from_labchart(
-    path: str,
+    path: Union[str, LabChartFile],
     *,
     block: int = 1,
     flow_col: str,
@@ -40,17 +145,24 @@ def compute_from_labchart(
     mechanically_ventilated: bool = False,
     insp_label: str = "INSPI",
     expi_label: str = "EXPI",
+    cache_dir: Optional[str] = None,
+    dtype: DTypeLike = np.float32,
 ) -> Dict[str, object]:
     """One-call pipeline with explicit channels and comment-based cycles.
 
     Parameters
     ----------
-    path : str
-        Path to LabChart .txt export.
+    path : str or LabChartFile
+        Path to LabChart .txt export, or an already-loaded LabChartFile. Passing
+        the loaded file avoids re-parsing the text export when analysing several
+        blocks or configurations of the same recording.
     block : int, default 1
         Block index to analyze.
     flow_col : str (required)
-        Name of the flow column (L/min).
+        Name of the flow column.
+    flow_unit : str (required)
+        Unit of the flow column, 'L/min' or 'L/s'. Applies to both the
+        spontaneous and the mechanical ventilation paths.
     volume_col : str or None, default None
         Name of the volume column (L). If None, VT will be integrated from flow.
     pressure_col : str or None, default None
@@ -61,6 +173,16 @@ def compute_from_labchart(
         compute ventilator mechanics (PEEP, Pplat, dP, Cstat, R, MAP). Otherwise skip.
     insp_label, expi_label : str
         Comment labels used to build cycles (default "INSPI"/"EXPI").
+    cache_dir : str or None, default None
+        If given, the parsed metadata, comments and block are cached in this
+        directory as Feather files (requires pyarrow), keyed by the path,
+        modification time and size of the .txt export. Later calls on the same
+        file read the cache instead of re-parsing the text. Metadata is stored
+        as JSON, so values JSON cannot represent come back as strings.
+    dtype : numpy dtype, default numpy.float32
+        Working dtype for the flow, volume and pressure samples. Time stays
+        float64 and integrals are accumulated in float64; pass numpy.float64
+        to compute everything in double precision.
 
     Returns
     -------
@@ -73,45 +195,44 @@ def compute_from_labchart(
         }
     """
     # 1) Load and select block
-    lc = LabChartFile.from_file(path)
-    df_block = lc.get_block_df(block)
+    meta, comments, df_block = _load_block(path, block, cache_dir)
 
     # 2) Cycles from comments (strictly)
     cycles = cycles_from_comments(
-        lc.comments,
+        comments,
         block=block,
         insp_label=insp_label,
         expi_label=expi_label,
     )
 
-    if mechanically_ventilated and _HAS_VENTILATOR and pressure_col is not None:
-        # Mechanical ventilation path: compute combined ventilatory+mechanical table
-        vent = mechanical_from_cycles(  # type: ignore[misc]
-            df_block,
-            cycles,
-            flow_col=flow_col,
-            pressure_col=pressure_col,
-            volume_col=volume_col,
+    # 3) Channel arrays, extracted once and shared by the metric kernels
+    #    (an empty/time-less block yields empty result tables, as the wrappers do)
+    if df_block is None or df_block.empty or 'time_abs' not in df_block.columns:
+        t, flow, vol, pressure = np.empty(0), None, None, None
+    else:
+        t, flow, vol, pressure = block_arrays(
+            df_block, flow_col, volume_col, pressure_col, dtype, flow_scale=flow_scale(flow_unit),
         )
-        # Extract only mechanical columns for the 'ventilator' view
+
+    if mechanically_ventilated and _HAS_VENTILATOR and pressure_col is not None:
+        # Mechanical ventilation path: one combined ventilatory+mechanical pass,
+        # sliced into the 'ventilatory' and 'ventilator' views
+        combined = mechanical_from_arrays(t, flow, pressure, vol, cycles)  # type: ignore[misc]
+        vent_cols = [c for c in [
+            'n_cycle','t_inspi','t_expi','Ti','Ttot','Te','BF','VT','VE','PIF','PEF','IE'
+        ] if c in combined.columns]
         mech_cols = [c for c in [
             'n_cycle','t_inspi','t_expi','PEEP','Ppeak','Pplat','dP','Cstat','R','MAP'
-        ] if c in vent.columns]
-        ventmech = vent[mech_cols].copy() if mech_cols else None
+        ] if c in combined.columns]
+        vent = combined[vent_cols]
+        ventmech = combined[mech_cols] if mech_cols else None
     else:
         # Spontaneous path: standard ventilatory variables only
-        vent = ventilatory_from_cycles(
-            df_block,
-            cycles,
-            flow_col=flow_col,
-            pressure_col=pressure_col,
-            volume_col=volume_col,
-            flow_unit=flow_unit,
-        )
+        vent = ventilatory_from_arrays(t, flow, vol, pressure, cycles)
         ventmech = None
 
     return {
-        "meta": lc.metadata,
+        "meta": meta,
         "cycles": cycles,
         "ventilatory": vent,
         "ventilator": ventmech,
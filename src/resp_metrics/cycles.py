@@ -9,6 +9,7 @@ on comment labels exported from LabChart (e.g. ``INSPI`` for inspiration,
 """
 
 from __future__ import annotations
+import numpy as np
 import pandas as pd
 
 
@@ -50,25 +51,32 @@ def cycles_from_comments(
     c = comments_df.loc[comments_df["block"] == block].copy()
     if c.empty:
         return pd.DataFrame(columns=["n_cycle", "t_inspi", "t_expi", "t_next_inspi"])
-    lab = c["Comment"].astype(str).str.strip().str.upper()
-    t = c["time_block"].to_numpy()
+    # normalise the (few) distinct labels once, then match comments by category code
+    comment = c["Comment"].astype("category")
+    labels = comment.cat.categories.astype(str).str.strip().str.upper()
+    codes = comment.cat.codes.to_numpy()
+    t = c["time_block"].to_numpy(dtype=float)
 
     # identify INSPI and EXPI times
-    t_inspi = t[lab == insp_label.upper()]
-    t_expi = t[lab == expi_label.upper()]
+    t_inspi = t[np.isin(codes, np.flatnonzero(labels == insp_label.upper()))]
+    t_expi = t[np.isin(codes, np.flatnonzero(labels == expi_label.upper()))]
 
-    rows = []
-    for i, ti in enumerate(t_inspi[:-1]):  # Skip last INSPI as it won't have a next INSPI
-        ex_after = t_expi[t_expi > ti]
-        if ex_after.size:
-            next_inspi = t_inspi[i + 1]  # Get next INSPI
-            rows.append({
-                "t_inspi": float(ti),
-                "t_expi": float(ex_after[0]),
-                "t_next_inspi": float(next_inspi)
-            })
+    # pair each INSPI (except the last, which has no next INSPI) with the first EXPI
+    # strictly after it; merge_asof needs sorted, non-null keys, so INSPI rows keep
+    # their position to restore the comment order afterwards
+    insp = pd.DataFrame({"t_inspi": t_inspi[:-1], "t_next_inspi": t_inspi[1:]})
+    insp = insp.dropna(subset=["t_inspi"]).sort_values("t_inspi", kind="stable").reset_index()
+    expi = pd.DataFrame({"t_expi": np.sort(t_expi[~np.isnan(t_expi)])})
+    out = pd.merge_asof(
+        insp, expi,
+        left_on="t_inspi", right_on="t_expi",
+        direction="forward", allow_exact_matches=False,
+    )
+    out = out.dropna(subset=["t_expi"]).sort_values("index")
 
-    out = pd.DataFrame(rows)
-    if not out.empty:
-        out.insert(0, "n_cycle", range(1, len(out) + 1))
-    return out
\ No newline at end of file
+    return pd.DataFrame({
+        "n_cycle": np.arange(1, len(out) + 1),
+        "t_inspi": out["t_inspi"].to_numpy(),
+        "t_expi": out["t_expi"].to_numpy(),
+        "t_next_inspi": out["t_next_inspi"].to_numpy(),
+    })
@@ -4,7 +4,8 @@ Mechanical ventilation mechanics computed cycle-by-cycle.
 This module provides:
 
     mechanical_from_cycles(df_block, cycles_df, flow_col="Flow",
-                           pressure_col="Pressure", volume_col="VolumeResp")
+                           pressure_col="Pressure", volume_col="VolumeResp",
+                           flow_unit="L/min")
 
 It returns a DataFrame with one row per cycle and the following columns:
   - n_cycle: 1-based cycle index
@@ -18,27 +19,132 @@ It returns a DataFrame with one row per cycle and the following columns:
   - Cstat: static compliance (VT / (Pplat - PEEP), in L/cmH2O) (depends on Pplat)
   - R: airway resistance estimate ((Ppeak - Pplat)/PIF, cmH2O·s/L) (depends on Pplat)
   - MAP: mean airway pressure over the cycle (cmH2O)
-  
-
 
+Metrics are computed one at a time across all cycles. The PEEP/Pplat window
+medians run in a Numba-compiled kernel when ``numba`` is installed, and fall
+back to a loop over ``bottleneck.nanmedian`` (or ``numpy.nanmedian``)
+otherwise.
 """
 
 from __future__ import annotations
 from typing import Optional
 import numpy as np
 import pandas as pd
-
-
-def _nearest_idx(vec: np.ndarray, target: float) -> int:
-    """Return index of element in vec nearest to target."""
-    return int(np.abs(vec - target).argmin())
-
-
-def _trapz(y: np.ndarray, x: np.ndarray) -> float:
-    """Safe trapezoidal integral."""
-    if y.size < 2 or x.size < 2:
-        return float("nan")
-    return float(np.trapz(y, x))
+from numpy.typing import DTypeLike
+
+from .utils import (
+    block_arrays, breathing_metrics, cumtrapz, cycle_bounds, empty_result, flow_scale,
+    segment_reduce, segment_trapz,
+)
+
+_COLUMNS = [
+    "n_cycle", "t_inspi", "t_expi",
+    "Ti", "Ttot", "Te", "BF", "VT", "VE", "PIF", "PEF", "IE",
+    "PEEP", "Ppeak", "Pplat", "dP", "Cstat", "R", "MAP",
+]
+
+
+try:
+    # Optional JIT compilation of the per-cycle kernel
+    from numba import njit
+    _HAS_NUMBA = True
+except Exception:  # pragma: no cover - absence is allowed
+    njit = None  # type: ignore
+    _HAS_NUMBA = False
+
+try:
+    # Optional C implementations of (nan)median for the NumPy fallback
+    from bottleneck import median as _median, nanmedian as _nanmedian
+except Exception:  # pragma: no cover - absence is allowed
+    _median, _nanmedian = np.median, np.nanmedian
+
+
+def _small_nanmedian(y: np.ndarray, a: int, b: int) -> float:
+    """Median of the non-NaN values of y[a:b]; insertion sort for short windows."""
+    buf = np.empty(max(b - a, 0))
+    n = 0
+    for j in range(a, b):
+        if not np.isnan(y[j]):
+            buf[n] = y[j]
+            n += 1
+    if n == 0:
+        return np.nan
+    if n <= 64:
+        for i in range(1, n):
+            x = buf[i]
+            j = i - 1
+            while j >= 0 and buf[j] > x:
+                buf[j + 1] = buf[j]
+                j -= 1
+            buf[j + 1] = x
+    else:
+        buf[:n] = np.sort(buf[:n])
+    if n % 2:
+        return buf[n // 2]
+    return 0.5 * (buf[n // 2 - 1] + buf[n // 2])
+
+
+def _window_medians(y, a, b):
+    """NaN-skipping median of y[a[k]:b[k]] for every window k (Numba-compiled when available)."""
+    out = np.empty(a.size)
+    for k in range(a.size):
+        out[k] = _small_nanmedian(y, a[k], b[k])
+    return out
+
+
+if _HAS_NUMBA:
+    _small_nanmedian = njit(cache=True)(_small_nanmedian)
+    _window_medians = njit(cache=True)(_window_medians)
+
+
+def _window_medians_numpy(y, a, b):
+    """NumPy fallback for `_window_medians` when Numba is not installed (uses bottleneck if present)."""
+    # NaN-aware medians only when the block actually contains NaNs
+    median = _nanmedian if np.isnan(y).any() else _median
+    out = np.full(a.size, np.nan)
+    for k in range(a.size):
+        if b[k] > a[k]:
+            out[k] = median(y[a[k]:b[k]])
+    return out
+
+
+def _plateau_windows(t, F, tail_a, tail_b, plateau_flow_thresh, plateau_min_dur):
+    """Sample window [a, b) of the longest low-flow run inside each tail window [tail_a, tail_b).
+
+    Runs of |F| <= plateau_flow_thresh are labelled once for the whole block,
+    then clipped to each cycle's tail window. The longest run lasting at least
+    plateau_min_dur wins (the earliest one on ties); cycles without such a run
+    get an empty window (a == b).
+    """
+    n = tail_a.size
+    low = np.abs(F) <= plateau_flow_thresh
+    edges = np.diff(low.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1  # inclusive
+
+    # One entry per (cycle, overlapping run) pair, grouped by cycle
+    r_lo = np.searchsorted(ends, tail_a, side="left")
+    r_hi = np.searchsorted(starts, tail_b, side="left")
+    counts = np.maximum(r_hi - r_lo, 0)
+    offsets = np.cumsum(counts) - counts
+    cyc_id = np.repeat(np.arange(n), counts)
+    run_id = r_lo[cyc_id] + np.arange(cyc_id.size) - offsets[cyc_id]
+    a = np.maximum(starts[run_id], tail_a[cyc_id])
+    b = np.minimum(ends[run_id], tail_b[cyc_id] - 1)
+    dur = t[b] - t[a]
+    dur = np.where((dur >= plateau_min_dur) & (dur > 0.0), dur, -np.inf)
+
+    win_a = np.zeros(n, dtype=np.intp)
+    win_b = np.zeros(n, dtype=np.intp)
+    if dur.size:
+        has_runs = counts > 0
+        best = np.full(n, -np.inf)
+        best[has_runs] = np.maximum.reduceat(dur, offsets[has_runs])
+        hit = np.flatnonzero(np.isfinite(dur) & (dur == best[cyc_id]))
+        cyc_hit, first = np.unique(cyc_id[hit], return_index=True)
+        win_a[cyc_hit] = a[hit[first]]
+        win_b[cyc_hit] = b[hit[first]] + 1
+    return win_a, win_b
 
 
 def mechanical_from_cycles(
@@ -47,158 +153,103 @@ def mechanical_from_cycles(
     flow_col: str = "Flow",
     pressure_col: str = "Pressure",
     volume_col: Optional[str] = "VolumeResp",
+    flow_unit: str = "L/min",          # 'L/min' or 'L/s'
     *,
     peep_window: float = 0.20,         # seconds before insp
     plateau_flow_thresh: float = 0.05, # |Flow| < threshold = plateau
-    plateau_min_dur: float = 0.10      # minimum duration for plateau
+    plateau_min_dur: float = 0.10,     # minimum duration for plateau
+    dtype: DTypeLike = np.float32,     # working dtype for F/P/V (time stays float64)
 ) -> pd.DataFrame:
     """Compute mechanical ventilation metrics per cycle."""
 
     needed = {"time_abs", pressure_col, flow_col}
     if df_block is None or df_block.empty or not needed.issubset(df_block.columns):
-        return pd.DataFrame(columns=[
-            "n_cycle","t_inspi","t_expi","PEEP","Ppeak","Pplat","dP","Cstat","R","MAP"
-        ])
+        return empty_result(_COLUMNS)
     if cycles_df is None or cycles_df.empty:
-        return pd.DataFrame(columns=[
-            "n_cycle","t_inspi","t_expi","PEEP","Ppeak","Pplat","dP","Cstat","R","MAP"
-        ])
-
-    # Use t_inspi for inspiration time
-    ti_col = "t_inspi"
-    if ti_col not in cycles_df.columns:
-        raise KeyError("cycles_df must contain 't_inspi'")
-    te_col = "t_expi"
-    if te_col not in cycles_df.columns:
-        raise KeyError("cycles_df must contain 't_expi'")
-    if "t_next_inspi" not in cycles_df.columns:
-        raise KeyError("cycles_df must contain 't_next_inspi'")
-
-    t = df_block["time_abs"].to_numpy()
-    P = df_block[pressure_col].to_numpy()
-    F = df_block[flow_col].to_numpy().astype(float) / 60.0  # L/min -> L/s, insp positive
-    
-    has_vol = (volume_col is not None) and (volume_col in df_block.columns)
-    V = df_block[volume_col].to_numpy() if has_vol else None
-
-    use_cols = [ti_col, te_col, "t_next_inspi"] + (["n_cycle"] if "n_cycle" in cycles_df.columns else [])
-    cyc = cycles_df[use_cols].dropna(subset=[ti_col, te_col]).copy()
-    cyc = cyc.sort_values(ti_col).reset_index(drop=True)
-    if "n_cycle" not in cyc.columns:
-        cyc.insert(0, "n_cycle", range(1, len(cyc) + 1))
-
-    rows = []
-    for _, r in cyc.iterrows():
-        ncy = int(r["n_cycle"])
-        ti, te = float(r[ti_col]), float(r[te_col])
-        t_next = r["t_next_inspi"]
-
-        i_insp = _nearest_idx(t, ti)
-        i_expi = _nearest_idx(t, te)
-        i0, i1 = sorted((i_insp, i_expi))
-
-        # --- Ventilatory variables (mechanical ventilation: inspiration positive) ---
-        Ti = float(t[i_expi] - t[i_insp])
-        if pd.notna(t_next):
-            i_next = _nearest_idx(t, float(t_next))
-            Ttot = float(t[i_next] - t[i_insp])
-        else:
-            i_next = None
-            Ttot = float('nan')
-        Te = (Ttot - Ti) if np.isfinite(Ttot) else float('nan')
-        BF = 60.0 / Ttot if (np.isfinite(Ttot) and Ttot > 0) else float('nan')
-
-        if has_vol:
-            VT = float(V[i1] - V[i0])
-        else:
-            VT = _trapz(F[i0:i1+1], t[i0:i1+1])  # insp positive -> VT > 0
-        VE = BF * VT if (np.isfinite(BF) and np.isfinite(VT)) else float('nan')
-
-        seg_insp = F[i0:i1+1]
-        PIF = float(np.nanmax(seg_insp)) if seg_insp.size else float('nan')
-
-        if i_next is not None and i_next > i_expi:
-            seg_exp = F[i_expi:i_next+1]
-            PEF = float(abs(np.nanmin(seg_exp))) if seg_exp.size else float('nan')
-        else:
-            PEF = float('nan')
-
-        IE = (Ti / Te) if (np.isfinite(Ti) and np.isfinite(Te) and Te > 0) else float('nan')
-
-        # --- PEEP: median pressure before insp ---
-        t0_peep = max(t[0], ti - peep_window)
-        m_peep = (t >= t0_peep) & (t < ti)
-        PEEP = float(np.nanmedian(P[m_peep])) if np.any(m_peep) else float("nan")
-
-        # --- Ppeak ---
-        Ppeak = float(np.nanmax(P[i0:i1+1])) if i1 > i0 else float("nan")
-
-        # --- Pplat: look for plateau near end-inspiration ---
-        # Plateau detection may fail without an inspiratory hold; Pplat will remain NaN in that case.
-        insp_dur = max(t[i1] - t[i0], 0.0)
-        tail_win = max(0.15, 0.3 * insp_dur)
-        t_start_tail = max(t[i0], t[i1] - tail_win)
-        m_tail = (t >= t_start_tail) & (t <= t[i1])
-        m_low = m_tail & (np.abs(F) <= plateau_flow_thresh)
-
-        Pplat = float("nan")
-        if np.any(m_low):
-            idx = np.where(m_low)[0]
-            gaps = np.where(np.diff(idx) > 1)[0]
-            starts = np.r_[0, gaps + 1]
-            ends = np.r_[gaps, len(idx) - 1]
-            best, best_dur = None, 0.0
-            for s, e in zip(starts, ends):
-                a, b = idx[s], idx[e]
-                dur = t[b] - t[a]
-                if dur >= plateau_min_dur and dur > best_dur:
-                    best, best_dur = (a, b), dur
-            if best is not None:
-                a, b = best
-                Pplat = float(np.nanmedian(P[a:b+1]))
+        return empty_result(_COLUMNS)
+
+    # Flow converted to L/s while casting, insp positive
+    t, F, V, P = block_arrays(df_block, flow_col, volume_col, pressure_col, dtype, flow_scale=flow_scale(flow_unit))
+    return mechanical_from_arrays(
+        t, F, P, V, cycles_df,
+        peep_window=peep_window,
+        plateau_flow_thresh=plateau_flow_thresh,
+        plateau_min_dur=plateau_min_dur,
+    )
+
+
+def mechanical_from_arrays(
+    t: np.ndarray,
+    F: Optional[np.ndarray],
+    P: Optional[np.ndarray],
+    V: Optional[np.ndarray],
+    cycles_df: pd.DataFrame,
+    *,
+    peep_window: float = 0.20,
+    plateau_flow_thresh: float = 0.05,
+    plateau_min_dur: float = 0.10,
+) -> pd.DataFrame:
+    """Array core of :func:`mechanical_from_cycles` (flow in L/s, inspiration positive)."""
+    if t.size == 0 or F is None or P is None or cycles_df is None or cycles_df.empty:
+        return empty_result(_COLUMNS)
+
+    # Cycle boundaries and ventilatory variables are shared with ventilatory_from_cycles
+    n_cycle, t_insp, i_insp, i_expi, i_next, has_next = cycle_bounds(t, cycles_df)
+    i0 = np.minimum(i_insp, i_expi)
+    i1 = np.maximum(i_insp, i_expi)
+
+    # --- Ventilatory variables (mechanical ventilation: inspiration positive) ---
+    vent = breathing_metrics(t, F, V, i_insp, i_expi, i_next, has_next, insp_positive=True)
+    VT, PIF = vent["VT"], vent["PIF"]
+
+    # --- Ppeak: one reduceat pass over the block ---
+    Ppeak = np.where(i1 > i0, segment_reduce(np.fmax, P, i0, i1), np.nan)
+
+    # --- PEEP window: samples in [ti - peep_window, ti) ---
+    peep_a = np.searchsorted(t, np.maximum(t[0], t_insp - peep_window), side="left")
+    peep_b = np.searchsorted(t, t_insp, side="left")
+
+    # --- Pplat window: end-inspiration tail, plateau may be absent without an inspiratory hold ---
+    insp_dur = np.maximum(t[i1] - t[i0], 0.0)
+    tail_win = np.maximum(0.15, 0.3 * insp_dur)
+    tail_a = np.searchsorted(t, np.maximum(t[i0], t[i1] - tail_win), side="left")
+    tail_b = np.searchsorted(t, t[i1], side="right")
+
+    plat_a, plat_b = _plateau_windows(t, F, tail_a, tail_b, plateau_flow_thresh, plateau_min_dur)
+
+    # --- Window medians (Numba kernel or NumPy fallback) ---
+    medians = _window_medians if _HAS_NUMBA else _window_medians_numpy
+    PEEP = medians(P, peep_a, peep_b)
+    Pplat = medians(P, plat_a, plat_b)
 
+    with np.errstate(divide="ignore", invalid="ignore"):
         # --- Driving pressure ---
-        if np.isfinite(Pplat) and np.isfinite(PEEP):
-            dP = Pplat - PEEP
-        elif np.isfinite(Ppeak) and np.isfinite(PEEP):
-            dP = Ppeak - PEEP
-        else:
-            dP = float("nan")
+        dP = np.where(np.isfinite(Pplat) & np.isfinite(PEEP), Pplat - PEEP,
+                      np.where(np.isfinite(Ppeak) & np.isfinite(PEEP), Ppeak - PEEP, np.nan))
 
         # --- Compliance ---
         # Requires a valid Pplat; otherwise remains NaN.
-        Cstat = (VT / (Pplat - PEEP)) if (np.isfinite(VT) and np.isfinite(Pplat) and np.isfinite(PEEP) and (Pplat > PEEP)) else float("nan")
+        Cstat = np.where(np.isfinite(VT) & (Pplat > PEEP), VT / (Pplat - PEEP), np.nan)
 
         # --- Resistance ---
         # Requires a valid Pplat; otherwise remains NaN.
-        if np.isfinite(Ppeak) and np.isfinite(Pplat) and (Ppeak > Pplat):
-            PIF_res = float(np.nanmax(F[i0:i1+1])) if i1 > i0 else float("nan")
-            R = ((Ppeak - Pplat) / PIF_res) if (np.isfinite(PIF_res) and PIF_res > 0) else float("nan")
-        else:
-            R = float("nan")
-
-        # --- Mean airway pressure ---
-        if pd.notna(t_next):
-            i_end = max(i_expi, i_next)
-        else:
-            i_end = i_expi
-        i2 = max(i_insp, 0)
-        i3 = min(i_end, len(t) - 1)
-        MAP_int = _trapz(P[i2:i3+1], t[i2:i3+1])
-        Ttot_map = t[i3] - t[i2] if i3 > i2 else float("nan")
-        MAP = (MAP_int / Ttot_map) if (np.isfinite(MAP_int) and np.isfinite(Ttot_map) and Ttot_map > 0) else float("nan")
-
-        rows.append({
-            # Common identifiers
-            "n_cycle": ncy,
-            "t_inspi": t[i_insp],
-            "t_expi": t[i_expi],
-            # Ventilatory variables
-            "Ti": Ti, "Ttot": Ttot, "Te": Te, "BF": BF,
-            "VT": VT, "VE": VE, "PIF": PIF, "PEF": PEF, "IE": IE,
-            # Mechanical variables
-            "PEEP": PEEP, "Ppeak": Ppeak, "Pplat": Pplat, "dP": dP,
-            "Cstat": Cstat, "R": R, "MAP": MAP,
-        })
-
-    return pd.DataFrame(rows)
\ No newline at end of file
+        PIF_res = np.where(i1 > i0, PIF, np.nan)
+        R = np.where((Ppeak > Pplat) & (PIF_res > 0), (Ppeak - Pplat) / PIF_res, np.nan)
+
+        # --- Mean airway pressure over the cycle ---
+        i_end = np.where(has_next, np.maximum(i_expi, i_next), i_expi)
+        MAP_int = segment_trapz(*cumtrapz(P, t), i_insp, i_end)
+        Ttot_map = t[i_end] - t[i_insp]
+        MAP = np.where(Ttot_map > 0, MAP_int / Ttot_map, np.nan)
+
+    return pd.DataFrame({
+        # Common identifiers
+        "n_cycle": n_cycle,
+        "t_inspi": t[i_insp],
+        "t_expi": t[i_expi],
+        # Ventilatory variables
+        **vent,
+        # Mechanical variables
+        "PEEP": PEEP, "Ppeak": Ppeak, "Pplat": Pplat, "dP": dP,
+        "Cstat": Cstat, "R": R, "MAP": MAP,
+    })
@@ -0,0 +1,204 @@
+"""
+Array helpers shared by the per-cycle metric modules.
+
+All functions operate on 1D NumPy arrays of a single block and on arrays of
+per-cycle sample indices, so that metrics can be computed for every cycle at
+once instead of looping over cycles in Python. The cycle-table helpers
+(:func:`block_arrays`, :func:`flow_scale`, :func:`cycle_bounds`,
+:func:`breathing_metrics`, :func:`empty_result`) are the parts common to
+spontaneous and mechanical ventilation.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.typing import DTypeLike
+
+
+def nearest_idx(vec: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Return indices of elements in sorted `vec` nearest to each of `targets`.
+
+    `vec` must be monotonically increasing (as LabChart time axes are). Ties
+    resolve to the lower index; NaN targets map to an arbitrary valid index
+    and must be masked by the caller.
+    """
+    targets = np.asarray(targets, dtype=float)
+    idx = np.searchsorted(vec, targets)
+    hi = np.minimum(idx, vec.size - 1)
+    lo = np.maximum(idx - 1, 0)
+    return np.where(np.abs(vec[lo] - targets) <= np.abs(vec[hi] - targets), lo, hi)
+
+
+def cumtrapz(y: np.ndarray, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Cumulative trapezoidal integral of `y` over `x`, starting at 0.
+
+    NaN trapezoids add 0 to the running sum; their running count is returned
+    alongside so that segments containing NaNs can be flagged afterwards.
+    """
+    area = 0.5 * (y[1:] + y[:-1]) * np.diff(x)
+    bad = np.isnan(area)
+    if not bad.any():
+        # common case (fully populated channel): skip the NaN bookkeeping
+        return np.concatenate(([0.0], np.cumsum(area))), np.zeros(x.size, dtype=np.intp)
+    cum = np.concatenate(([0.0], np.cumsum(np.where(bad, 0.0, area))))
+    n_bad = np.concatenate(([0], np.cumsum(bad)))
+    return cum, n_bad
+
+
+def segment_trapz(cum: np.ndarray, n_bad: np.ndarray, i0: np.ndarray, i1: np.ndarray) -> np.ndarray:
+    """Trapezoidal integrals over samples [i0, i1] from a :func:`cumtrapz` prefix.
+
+    Segments with fewer than two samples or containing NaNs yield NaN.
+    """
+    valid = (i1 > i0) & (n_bad[i1] == n_bad[i0])
+    return np.where(valid, cum[i1] - cum[i0], np.nan)
+
+
+def segment_reduce(ufunc: np.ufunc, y: np.ndarray, i0: np.ndarray, i1: np.ndarray) -> np.ndarray:
+    """Reduce each segment y[i0:i1+1] with `ufunc` in one `reduceat` call (requires i0 <= i1)."""
+    # one trailing NaN lets i1 + 1 address one past the last sample (dtype kept)
+    padded = np.empty(y.size + 1, dtype=np.result_type(y.dtype, np.float32))
+    padded[:-1] = y
+    padded[-1] = np.nan
+    bounds = np.column_stack((i0, i1 + 1)).ravel()
+    return ufunc.reduceat(padded, bounds)[::2]
+
+
+def block_arrays(
+    df_block: pd.DataFrame,
+    flow_col: Optional[str],
+    volume_col: Optional[str],
+    pressure_col: Optional[str],
+    dtype: DTypeLike = np.float32,
+    flow_scale: float = 1.0,
+) -> Tuple[np.ndarray, Optional[np.ndarray], Optional[np.ndarray], Optional[np.ndarray]]:
+    """Extract (t, flow, volume, pressure) arrays once from a block; missing channels are None.
+
+    Time is float64. Channels are cast to `dtype`, without copying when they
+    already have it; flow is multiplied by `flow_scale` in the same pass.
+    """
+    def channel(col: Optional[str], scale: float = 1.0) -> Optional[np.ndarray]:
+        if col is None or col not in df_block.columns:
+            return None
+        raw = df_block[col].to_numpy()
+        if scale == 1.0:
+            return raw.astype(dtype, copy=False)
+        return np.multiply(raw, np.dtype(dtype).type(scale), dtype=dtype)
+
+    t = df_block['time_abs'].to_numpy(dtype=np.float64)
+    return t, channel(flow_col, flow_scale), channel(volume_col), channel(pressure_col)
+
+
+def flow_scale(flow_unit: str) -> float:
+    """Factor converting flow in `flow_unit` ('L/s' or 'L/min') to L/s."""
+    if flow_unit.lower() in ['l/s', 'l/sec', 'ls']:
+        return 1.0
+    if flow_unit.lower() in ['l/min', 'lpm']:
+        return 1.0 / 60.0  # L/min -> L/s
+    raise ValueError(f"Unsupported flow unit: {flow_unit}. Use 'L/s' or 'L/min'.")
+
+
+def empty_result(columns: Sequence[str]) -> pd.DataFrame:
+    """Zero-row result with `columns` and the dtypes of a computed one (int64 n_cycle, float64 otherwise)."""
+    return pd.DataFrame({c: np.empty(0, np.int64 if c == 'n_cycle' else np.float64) for c in columns})
+
+
+def cycle_bounds(t: np.ndarray, cycles_df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Clean cycle table and nearest-sample boundary indices for all cycles.
+
+    Returns (n_cycle, t_inspi, i_insp, i_expi, i_next, has_next) for the rows
+    with both t_inspi and t_expi, sorted by t_inspi. Without a 't_next_inspi'
+    column, each cycle ends at the next cycle's t_inspi (the last one has none).
+    """
+    for col in ('t_inspi', 't_expi'):
+        if col not in cycles_df.columns:
+            raise KeyError(f"cycles_df must contain a '{col}' column")
+
+    ti = cycles_df['t_inspi'].to_numpy(dtype=np.float64)
+    te = cycles_df['t_expi'].to_numpy(dtype=np.float64)
+    keep = np.flatnonzero(~(np.isnan(ti) | np.isnan(te)))
+    order = keep[np.argsort(ti[keep], kind='stable')]
+    ti, te = ti[order], te[order]
+
+    if 't_next_inspi' in cycles_df.columns:
+        t_next = cycles_df['t_next_inspi'].to_numpy(dtype=np.float64)[order]
+    else:
+        t_next = np.empty_like(ti)
+        t_next[:-1] = ti[1:]
+        t_next[-1:] = np.nan
+    if 'n_cycle' in cycles_df.columns:
+        n_cycle = cycles_df['n_cycle'].to_numpy()[order].astype(np.int64)
+    else:
+        n_cycle = np.arange(1, ti.size + 1, dtype=np.int64)
+
+    # Sample indices nearest to each cycle boundary, looked up once for all cycles
+    i_insp = nearest_idx(t, ti)
+    i_expi = nearest_idx(t, te)
+    i_next = nearest_idx(t, t_next)
+    has_next = ~np.isnan(t_next)
+    return n_cycle, ti, i_insp, i_expi, i_next, has_next
+
+
+def breathing_metrics(
+    t: np.ndarray,
+    flow: Optional[np.ndarray],
+    vol: Optional[np.ndarray],
+    i_insp: np.ndarray,
+    i_expi: np.ndarray,
+    i_next: np.ndarray,
+    has_next: np.ndarray,
+    insp_positive: bool,
+) -> Dict[str, np.ndarray]:
+    """Ti, Ttot, Te, BF, VT, VE, PIF, PEF and IE for all cycles at once.
+
+    `flow` (L/s) and `vol` (L) may be None. Flow is negative during inspiration
+    unless `insp_positive` (mechanical ventilation convention); VT, PIF and PEF
+    are returned as positive quantities in both conventions.
+    """
+    i0 = np.minimum(i_insp, i_expi)
+    i1 = np.maximum(i_insp, i_expi)
+    nan = np.full(i_insp.size, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Durations
+        Ti = t[i_expi] - t[i_insp]
+        Ttot = np.where(has_next, t[i_next] - t[i_insp], np.nan)
+        Te = Ttot - Ti
+        BF = np.where(Ttot > 0, 60.0 / Ttot, np.nan)
+
+        # VT (ΔVolume if available, else integrate Flow)
+        if vol is not None:
+            VT = (vol[i_expi] - vol[i_insp]).astype(np.float64, copy=False)
+        elif flow is not None:
+            VT = segment_trapz(*cumtrapz(flow, t), i0, i1)
+            if not insp_positive:
+                VT = -VT
+        else:
+            VT = nan
+
+        VE = BF * VT
+
+        # Peaks (magnitudes): inspiration-side extreme for PIF, expiration-side extreme for PEF
+        if flow is not None:
+            has_exp = has_next & (i_next > i_expi)
+            i_exp_end = np.where(has_exp, i_next, i_expi)
+            if insp_positive:
+                PIF = segment_reduce(np.fmax, flow, i0, i1)
+                PEF = np.abs(segment_reduce(np.fmin, flow, i_expi, i_exp_end))
+            else:
+                PIF = np.abs(segment_reduce(np.fmin, flow, i0, i1))
+                PEF = segment_reduce(np.fmax, flow, i_expi, i_exp_end)
+            PEF = np.where(has_exp, PEF, np.nan)
+        else:
+            PIF = nan
+            PEF = nan
+
+        IE = np.where(Te > 0, Ti / Te, np.nan)
+
+    return {
+        'Ti': Ti, 'Ttot': Ttot, 'Te': Te, 'BF': BF,
+        'VT': VT, 'VE': VE, 'PIF': PIF, 'PEF': PEF, 'IE': IE,
+    }
@@ -22,7 +22,8 @@ Assumptions:
   - Flow can be in L/min or L/s (specified by flow_unit parameter)
   - Flow is negative during inspiration (spontaneous breathing convention)
   - PIF/PEF are returned as magnitudes (L/s)
-  - cycles_df contains 't_inspi', 't_expi', and 't_next_inspi' (from cycles_from_comments)
+  - cycles_df contains 't_inspi', 't_expi' and usually 't_next_inspi' (from
+    cycles_from_comments); without it, each cycle ends at the next t_inspi
 
 Notes:
   - If `volume_col` is available, VT is computed as ΔVolume on inspiration.
@@ -37,18 +38,12 @@ from typing import Optional
 
 import numpy as np
 import pandas as pd
+from numpy.typing import DTypeLike
 
+from .utils import block_arrays, breathing_metrics, cumtrapz, cycle_bounds, empty_result, flow_scale, segment_trapz
 
-def _nearest_idx(vec: np.ndarray, target: float) -> int:
-    """Return index of element in `vec` nearest to `target` (assumes 1D arrays)."""
-    return int(np.abs(vec - target).argmin())
-
-
-def _trapz(y: np.ndarray, x: np.ndarray) -> float:
-    """Safe trapezoidal integral; returns NaN when not enough samples."""
-    if y.size < 2 or x.size < 2:
-        return float("nan")
-    return float(np.trapz(y, x))
+_COLUMNS = ['n_cycle', 't_inspi', 't_expi', 'Ti', 'Ttot', 'Te', 'BF',
+            'VT', 'VE', 'PIF', 'PEF', 'IE', 'WOB', 'PTP']
 
 
 def ventilatory_from_cycles(
@@ -57,7 +52,8 @@ def ventilatory_from_cycles(
     flow_col: str = "Flow",
     volume_col: Optional[str] = "VolumeResp",
     pressure_col: Optional[str] = "Paw",
-    flow_unit: str = "L/min"
+    flow_unit: str = "L/min",
+    dtype: DTypeLike = np.float32,
 ) -> pd.DataFrame:
     """Compute ventilatory variables per cycle.
 
@@ -77,6 +73,10 @@ def ventilatory_from_cycles(
         Column name for airway pressure signal (cmH2O). Required for WOB calculation.
     flow_unit : str, default 'L/min'
         Unit of the flow signal. Accepted values are 'L/min' and 'L/s'.
+    dtype : numpy dtype, default numpy.float32
+        Working dtype for the flow, volume and pressure samples. Time stays
+        float64 and integrals are accumulated in float64; pass numpy.float64
+        if the channels carry more precision than float32 holds.
 
     Returns
     -------
@@ -86,124 +86,57 @@ def ventilatory_from_cycles(
     """
     # Guard clauses
     if df_block is None or df_block.empty:
-        return pd.DataFrame(columns=[
-            'n_cycle','t_inspi','t_expi','Ti','Ttot','Te','BF','VT','VE','PIF','PEF','IE', 'WOB', 'PTP'
-        ])
+        return empty_result(_COLUMNS)
     if cycles_df is None or cycles_df.empty:
-        return pd.DataFrame(columns=[
-            'n_cycle','t_inspi','t_expi','Ti','Ttot','Te','BF','VT','VE','PIF','PEF','IE', 'WOB', 'PTP'
-        ])
+        return empty_result(_COLUMNS)
 
     # Required time axis
     if 'time_abs' not in df_block.columns:
         raise KeyError("df_block must contain a 'time_abs' column")
 
-    t = df_block['time_abs'].to_numpy()
-    # Optional channels
-    has_flow = flow_col in df_block.columns
-    has_vol = (volume_col is not None) and (volume_col in df_block.columns)
-    has_pressure = (pressure_col is not None) and (pressure_col in df_block.columns)
-
-    flow = df_block[flow_col].to_numpy() if has_flow else None
-    pressure = df_block[pressure_col].to_numpy() if has_pressure else None
-    if flow is not None:
-        # Convert flow to L/s if needed (spontaneous convention: inspiration negative)
-        flow = flow.astype(float)
-        if flow_unit.lower() not in ['l/s', 'l/sec', 'ls']:
-            if flow_unit.lower() in ['l/min', 'lpm']:
-                flow = flow / 60.0  # L/min -> L/s
-            else:
-                raise ValueError(f"Unsupported flow unit: {flow_unit}. Use 'L/s' or 'L/min'.")
-    vol = df_block[volume_col].to_numpy() if has_vol else None
-
-    # Use t_inspi for inspiration time
-    ti_col = 't_inspi'
-    if ti_col not in cycles_df.columns:
-        raise KeyError("cycles_df must contain a 't_inspi' column")
-    te_col = 't_expi'
-    if te_col not in cycles_df.columns:
-        raise KeyError("cycles_df must contain a 't_expi' column")
-
-    base_cols = [ti_col, te_col, 't_next_inspi']
-    use_cols = base_cols + (['n_cycle'] if 'n_cycle' in cycles_df.columns else [])
-    cyc = cycles_df[use_cols].dropna(subset=[ti_col, te_col]).copy()
-    cyc = cyc.sort_values(ti_col).reset_index(drop=True)
-    if 'n_cycle' not in cyc.columns:
-        cyc.insert(0, 'n_cycle', range(1, len(cyc) + 1))
-
-    rows = []
-    for i, row in cyc.iterrows():
-        ti = float(row[ti_col])
-        te = float(row[te_col])
-        t_next = row['t_next_inspi']
-
-        i_insp = _nearest_idx(t, ti)
-        i_expi = _nearest_idx(t, te)
-
-        # Durations
-        Ti = float(t[i_expi] - t[i_insp])
-        if pd.notna(t_next):
-            i_next = _nearest_idx(t, float(t_next))
-            Ttot = float(t[i_next] - t[i_insp])
-        else:
-            i_next = None
-            Ttot = float('nan')
-        Te = (Ttot - Ti) if np.isfinite(Ttot) else float('nan')
-        BF = 60.0 / Ttot if (np.isfinite(Ttot) and Ttot > 0) else float('nan')
-
-        # VT (ΔVolume if available, else integrate Flow)
-        if has_vol:
-            VT = float(vol[i_expi] - vol[i_insp])
-        elif has_flow:
-            # integrate flow between i_insp and i_expi (inclusive)
-            i0, i1 = sorted((i_insp, i_expi))
-            # flow is negative during inspiration -> negate to return positive VT
-            VT = -_trapz(flow[i0:i1+1], t[i0:i1+1])
-        else:
-            VT = float('nan')
-
-        VE = BF * VT if (np.isfinite(BF) and np.isfinite(VT)) else float('nan')
-
-        # Peaks (magnitudes): inspiration negative -> use abs(min) for PIF; expiration positive -> max
-        if has_flow:
-            i0, i1 = sorted((i_insp, i_expi))
-            seg_insp = flow[i0:i1+1]
-            PIF = float(abs(np.nanmin(seg_insp))) if seg_insp.size else float('nan')
-
-            if i_next is not None and i_next > i_expi:
-                seg_exp = flow[i_expi:i_next+1]
-                PEF = float(np.nanmax(seg_exp)) if seg_exp.size else float('nan')
-            else:
-                PEF = float('nan')
-        else:
-            PIF = float('nan')
-            PEF = float('nan')
-
-        IE = (Ti / Te) if (np.isfinite(Ti) and np.isfinite(Te) and Te > 0) else float('nan')
-
-        # WOB calculation
-        if has_pressure and has_flow:
-            i0, i1 = sorted((i_insp, i_expi))
-            # Conversion cmH2O -> kPa (1 cmH2O = 0.0980665 kPa)
-            pressure_kpa = pressure[i0:i1+1] * 0.0980665
-            # WOB en Joules (kPa * L = J)
-            WOB = -_trapz(pressure_kpa * flow[i0:i1+1], t[i0:i1+1])
-        else:
-            WOB = float('nan')
-        
-        # PTP calculation (cmH2O·s)
-        if has_pressure:
-            i0, i1 = sorted((i_insp, i_expi))
-            PTP = _trapz(pressure[i0:i1+1], t[i0:i1+1])
-        else:
-            PTP = float('nan')
-
-        rows.append({
-            'n_cycle': int(cyc.loc[i, 'n_cycle']),
-            't_inspi': t[i_insp], 't_expi': t[i_expi],
-            'Ti': Ti, 'Ttot': Ttot, 'Te': Te, 'BF': BF,
-            'VT': VT, 'VE': VE, 'PIF': PIF, 'PEF': PEF, 'IE': IE,
-            'WOB': WOB, 'PTP': PTP,
-        })
-
-    return pd.DataFrame(rows)
\ No newline at end of file
+    # Flow converted to L/s while casting (spontaneous convention: inspiration negative)
+    t, flow, vol, pressure = block_arrays(
+        df_block, flow_col, volume_col, pressure_col, dtype, flow_scale=flow_scale(flow_unit),
+    )
+    return ventilatory_from_arrays(t, flow, vol, pressure, cycles_df)
+
+
+def ventilatory_from_arrays(
+    t: np.ndarray,
+    flow: Optional[np.ndarray],
+    vol: Optional[np.ndarray],
+    pressure: Optional[np.ndarray],
+    cycles_df: pd.DataFrame,
+) -> pd.DataFrame:
+    """Array core of :func:`ventilatory_from_cycles` (flow in L/s, inspiration negative)."""
+    if t.size == 0 or cycles_df is None or cycles_df.empty:
+        return empty_result(_COLUMNS)
+
+    n_cycle, _, i_insp, i_expi, i_next, has_next = cycle_bounds(t, cycles_df)
+    i0 = np.minimum(i_insp, i_expi)
+    i1 = np.maximum(i_insp, i_expi)
+    nan = np.full(n_cycle.size, np.nan)
+
+    metrics = breathing_metrics(t, flow, vol, i_insp, i_expi, i_next, has_next, insp_positive=False)
+
+    # WOB calculation
+    if pressure is not None and flow is not None:
+        # Conversion cmH2O -> kPa (1 cmH2O = 0.0980665 kPa)
+        pressure_kpa = pressure * 0.0980665
+        # WOB en Joules (kPa * L = J)
+        WOB = -segment_trapz(*cumtrapz(pressure_kpa * flow, t), i0, i1)
+    else:
+        WOB = nan
+
+    # PTP calculation (cmH2O·s)
+    if pressure is not None:
+        PTP = segment_trapz(*cumtrapz(pressure, t), i0, i1)
+    else:
+        PTP = nan
+
+    return pd.DataFrame({
+        'n_cycle': n_cycle,
+        't_inspi': t[i_insp], 't_expi': t[i_expi],
+        **metrics,
+        'WOB': WOB, 'PTP': PTP,
+    })